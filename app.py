@@ -3,37 +3,65 @@ Expense Tracker - Flask Web Application
 A responsive web app for tracking expenses
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 import mysql.connector
 from mysql.connector import pooling
-from datetime import datetime, timedelta
+from datetime import datetime, date
+from decimal import Decimal
 from functools import wraps
 import os
+import csv
+import io
+import profiling
+import http_cache
+import live_updates
+import partitions
+import write_queue
+import passwords
+import throttle
+import snapshots
+import currency
+from config import DB_CONFIG
 
 app = Flask(__name__)
 app.secret_key = 'expense_tracker_secret_key_2025'
 
-# Database Configuration
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '12345',
-    'database': 'expense_tracker'
-}
+# Password KDF workers (see passwords.py) re-import this script as
+# __mp_main__; they only need the hashing functions, not a pool, DDL or
+# background threads
+SERVING = __name__ != '__mp_main__'
 
 # Connection Pool
-try:
-    connection_pool = pooling.MySQLConnectionPool(
-        pool_name="expense_pool",
-        pool_size=5,
-        **DB_CONFIG
-    )
-    print("✅ Database connection pool created successfully!")
-except Exception as e:
-    print(f"❌ Database connection failed: {e}")
-    connection_pool = None
+connection_pool = None
+if SERVING:
+    try:
+        connection_pool = pooling.MySQLConnectionPool(
+            pool_name="expense_pool",
+            pool_size=5,
+            **DB_CONFIG
+        )
+        print("✅ Database connection pool created successfully!")
+    except Exception as e:
+        print(f"❌ Database connection failed: {e}")
+
+# Group commit for expense inserts (GROUP_COMMIT_ENABLED=1)
+def bump_batch_versions(cursor, rows):
+    for user_id in {row[0] for row in rows}:
+        http_cache.bump_user_version(cursor, user_id)
+
+expense_writer = None
+if write_queue.GROUP_COMMIT_ENABLED and SERVING:
+    expense_writer = write_queue.GroupCommitQueue(
+        lambda: mysql.connector.connect(**DB_CONFIG), write_queue.INSERT_EXPENSE_WITH_CURRENCY
+        if currency.FX_ENABLED else write_queue.INSERT_EXPENSE,
+        before_commit=bump_batch_versions)
+
+# Query Profiling
+profiling.init_app(app)
+
+# HTTP Caching
+http_cache.init_app(app, lambda: get_db_connection())
 
 # Flask-Login Setup
 login_manager = LoginManager()
@@ -41,11 +69,12 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 class User(UserMixin):
-    def __init__(self, user_id, username, email, full_name):
+    def __init__(self, user_id, username, email, full_name, home_currency=None):
         self.id = user_id
         self.username = username
         self.email = email
         self.full_name = full_name
+        self.home_currency = home_currency or currency.DEFAULT_HOME_CURRENCY
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -58,15 +87,66 @@ def load_user(user_id):
         conn.close()
         if user_data:
             return User(user_data['user_id'], user_data['username'], 
-                       user_data['email'], user_data['full_name'])
+                       user_data['email'], user_data['full_name'],
+                       user_data.get('home_currency'))
     return None
 
 def get_db_connection():
     try:
-        return connection_pool.get_connection()
+        return profiling.checkout(connection_pool)
     except:
         return None
 
+# FX rate cache (MULTI_CURRENCY_ENABLED=1)
+currency.init(get_db_connection)
+
+# Dashboard Snapshots
+snapshot_scheduler = None
+if SERVING:
+    snapshot_scheduler = snapshots.SnapshotScheduler(get_db_connection)
+    profiling.register_collector(snapshot_scheduler.metrics_lines)
+if connection_pool:
+    try:
+        snapshot_conn = connection_pool.get_connection()
+        http_cache.ensure_table(snapshot_conn)
+        snapshots.ensure_table(snapshot_conn)
+        snapshot_conn.close()
+    except Exception as e:
+        print(f"❌ Version and snapshot table setup failed: {e}")
+
+def current_month_range():
+    """First day of this month and of the next, for partition-pruned range filters"""
+    start = partitions.month_start(date.today())
+    return start, partitions.add_months(start, 1)
+
+def flash_unconverted(currencies):
+    """Tell the user which currencies could not be converted into the totals"""
+    if currencies:
+        flash(f"No exchange rate for {', '.join(currencies)}; "
+              "those expenses are left out of the totals.", 'error')
+
+def expense_delta(amount, expense_currency, expense_date, cursor=None):
+    """Delta fields with ``amount`` in the home currency dashboards total in,
+    or None when it cannot be converted"""
+    home = current_user.home_currency
+    converted = Decimal(str(amount))
+    if currency.FX_ENABLED:
+        converted = currency.home_amount(currency.rates, amount, expense_currency,
+                                         expense_date, home, cursor)
+        if converted is None:
+            return None
+    return {'amount': float(converted), 'currency': home,
+            'original_amount': float(amount), 'original_currency': expense_currency}
+
+def notify_change(event, data):
+    """Push a delta to open dashboards and schedule a snapshot refresh.
+
+    The data version behind ETags is bumped by the write itself, inside
+    its transaction, before this runs.
+    """
+    live_updates.publish(current_user.id, event, data)
+    snapshot_scheduler.schedule(current_user.id)
+
 # ==================== ROUTES ====================
 
 @app.route('/')
@@ -84,6 +164,14 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
+        # Reject floods before any database or hashing work
+        account = (username or '').strip().lower()
+        if (not throttle.login_by_ip.allow(request.remote_addr)
+                or not throttle.login_by_ip_account.allow((request.remote_addr, account))
+                or not throttle.login_by_account.allow(account)):
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('login.html'), 429
+        
         conn = get_db_connection()
         if conn:
             cursor = conn.cursor(dictionary=True)
@@ -93,9 +181,29 @@ def login():
             cursor.close()
             conn.close()
             
-            if user_data and check_password_hash(user_data['password'], password):
+            valid, new_hash = False, None
+            if user_data:
+                try:
+                    valid, new_hash = passwords.verify_password(user_data['password'], password)
+                except passwords.KdfBusy:
+                    flash('Server is busy. Please try again in a moment.', 'error')
+                    return render_template('login.html'), 503
+            
+            if valid and new_hash:
+                # Upgrade hashes made with older cost parameters
+                conn = get_db_connection()
+                if conn:
+                    cursor = conn.cursor()
+                    cursor.execute("UPDATE users SET password = %s WHERE user_id = %s",
+                                  (new_hash, user_data['user_id']))
+                    conn.commit()
+                    cursor.close()
+                    conn.close()
+            
+            if valid:
                 user = User(user_data['user_id'], user_data['username'],
-                           user_data['email'], user_data['full_name'])
+                           user_data['email'], user_data['full_name'],
+                           user_data.get('home_currency'))
                 login_user(user, remember=request.form.get('remember'))
                 flash('Welcome back!', 'success')
                 return redirect(url_for('dashboard'))
@@ -115,6 +223,10 @@ def register():
         password = request.form.get('password')
         full_name = request.form.get('full_name')
         
+        if not throttle.login_by_ip.allow(request.remote_addr):
+            flash('Too many attempts. Please wait a minute and try again.', 'error')
+            return render_template('register.html'), 429
+        
         conn = get_db_connection()
         if conn:
             cursor = conn.cursor(dictionary=True)
@@ -127,9 +239,22 @@ def register():
                 cursor.close()
                 conn.close()
                 return render_template('register.html')
+            cursor.close()
+            conn.close()
+            
+            # Hash without holding a pooled connection
+            try:
+                hashed_password = passwords.hash_password(password)
+            except passwords.KdfBusy:
+                flash('Server is busy. Please try again in a moment.', 'error')
+                return render_template('register.html'), 503
+            
+            conn = get_db_connection()
+            if not conn:
+                return render_template('register.html')
             
             # Create user
-            hashed_password = generate_password_hash(password)
+            cursor = conn.cursor(dictionary=True)
             cursor.execute("""
                 INSERT INTO users (username, email, password, full_name)
                 VALUES (%s, %s, %s, %s)
@@ -161,17 +286,15 @@ def dashboard():
     if conn:
         cursor = conn.cursor(dictionary=True)
         
-        # Get stats
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(amount), 0) as total,
-                COUNT(*) as count,
-                COALESCE(AVG(amount), 0) as avg,
-                COALESCE(MAX(amount), 0) as max
-            FROM expenses 
-            WHERE user_id = %s AND MONTH(expense_date) = MONTH(CURRENT_DATE())
-        """, (current_user.id,))
-        stats = cursor.fetchone()
+        # Stats and category totals for pie chart, precomputed when possible
+        snapshot = snapshot_scheduler.lookup(cursor, current_user.id, 'month')
+        if snapshot:
+            stats, category_data = snapshot['stats'], snapshot['categories']
+        else:
+            month_start, month_end = current_month_range()
+            stats, category_data = snapshots.month_summary(
+                cursor, current_user.id, month_start, month_end, current_user.home_currency)
+        flash_unconverted(stats.get('unconverted'))
         
         # Get recent expenses
         cursor.execute("""
@@ -184,17 +307,6 @@ def dashboard():
         """, (current_user.id,))
         recent_expenses = cursor.fetchall()
         
-        # Get category totals for pie chart
-        cursor.execute("""
-            SELECT c.category_name, c.icon, c.color, SUM(e.amount) as total
-            FROM expenses e
-            JOIN categories c ON e.category_id = c.category_id
-            WHERE e.user_id = %s AND MONTH(e.expense_date) = MONTH(CURRENT_DATE())
-            GROUP BY c.category_id
-            ORDER BY total DESC
-        """, (current_user.id,))
-        category_data = cursor.fetchall()
-        
         cursor.close()
         conn.close()
     
@@ -249,16 +361,45 @@ def add_expense():
             expense_date = request.form.get('expense_date')
             payment_method = request.form.get('payment_method', 'Cash')
             notes = request.form.get('notes', '')
+            expense_currency = current_user.home_currency
+            if currency.FX_ENABLED:
+                expense_currency = currency.rates.known_code(
+                    request.form.get('currency'), current_user.home_currency, cursor)
+                if expense_currency is None:
+                    flash('Unknown currency. Use a 3-letter code that has exchange rates.', 'error')
+                    cursor.close()
+                    conn.close()
+                    return render_template('add_expense.html', categories=categories), 400
+            params = (current_user.id, category_id, amount, description,
+                      expense_date, payment_method, notes)
+            insert_sql = write_queue.INSERT_EXPENSE
+            if currency.FX_ENABLED:
+                params += (expense_currency,)
+                insert_sql = write_queue.INSERT_EXPENSE_WITH_CURRENCY
+            delta = expense_delta(amount, expense_currency, expense_date, cursor)
             
-            cursor.execute("""
-                INSERT INTO expenses (user_id, category_id, amount, description, 
-                                     expense_date, payment_method, notes)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (current_user.id, category_id, amount, description,
-                  expense_date, payment_method, notes))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            if expense_writer:
+                # Release the pooled connection while the batch commits
+                cursor.close()
+                conn.close()
+                expense_id = expense_writer.insert(params)
+            else:
+                cursor.execute(insert_sql, params)
+                expense_id = cursor.lastrowid
+                http_cache.bump_user_version(cursor, current_user.id)
+                conn.commit()
+                cursor.close()
+                conn.close()
+            
+            category_name = next((c['category_name'] for c in categories
+                                  if str(c['category_id']) == str(category_id)), None)
+            if delta is None:
+                # No rate into the home currency; dashboards reload the aggregate
+                notify_change('resync', {})
+            else:
+                notify_change('expense_added', dict(delta,
+                    expense_id=expense_id, category_id=category_id, category_name=category_name,
+                    description=description, expense_date=expense_date))
             
             flash('Expense added successfully!', 'success')
             return redirect(url_for('expenses'))
@@ -273,16 +414,36 @@ def add_expense():
 def delete_expense(expense_id):
     conn = get_db_connection()
     if conn:
-        cursor = conn.cursor()
+        cursor = conn.cursor(dictionary=True)
+        columns = 'category_id, amount, expense_date'
+        if currency.FX_ENABLED:
+            columns += ', currency'
+        cursor.execute(f"""
+            SELECT {columns} FROM expenses
+            WHERE expense_id = %s AND user_id = %s
+        """, (expense_id, current_user.id))
+        deleted = cursor.fetchone()
+        delta = None
+        if deleted:
+            delta = expense_delta(deleted['amount'],
+                                  deleted.get('currency', current_user.home_currency),
+                                  deleted['expense_date'], cursor)
         cursor.execute("DELETE FROM expenses WHERE expense_id = %s AND user_id = %s",
                       (expense_id, current_user.id))
+        http_cache.bump_user_version(cursor, current_user.id)
         conn.commit()
         cursor.close()
         conn.close()
+        if deleted and delta is None:
+            notify_change('resync', {})
+        elif deleted:
+            notify_change('expense_deleted', dict(delta, expense_id=expense_id,
+                category_id=deleted['category_id'], expense_date=deleted['expense_date']))
         flash('Expense deleted!', 'success')
     return redirect(url_for('expenses'))
 
 @app.route('/reports')
+@http_cache.conditional_get
 @login_required
 def reports():
     period = request.args.get('period', 'month')
@@ -297,32 +458,45 @@ def reports():
         
         # Date range based on period
         if period == 'week':
-            start_date = datetime.now() - timedelta(days=7)
+            start_date = snapshots.week_start()
         elif period == 'month':
             start_date = datetime.now().replace(day=1)
         else:  # year
             start_date = datetime.now().replace(month=1, day=1)
         
-        # Category totals
-        cursor.execute("""
-            SELECT c.category_name, c.icon, c.color, SUM(e.amount) as total
-            FROM expenses e
-            JOIN categories c ON e.category_id = c.category_id
-            WHERE e.user_id = %s AND e.expense_date >= %s
-            GROUP BY c.category_id
-            ORDER BY total DESC
-        """, (current_user.id, start_date.strftime('%Y-%m-%d')))
-        category_data = cursor.fetchall()
+        # Category and daily totals; the last 7 days are precomputed
+        snapshot = None
+        if period == 'week':
+            snapshot = snapshot_scheduler.lookup(cursor, current_user.id, 'week')
+        if snapshot:
+            category_data, daily_data = snapshot['categories'], snapshot['daily']
+            unconverted = snapshot['unconverted']
+        else:
+            category_data, daily_data, unconverted = snapshots.period_totals(
+                cursor, current_user.id, start_date, current_user.home_currency)
         
-        # Daily totals
-        cursor.execute("""
-            SELECT DATE(expense_date) as date, SUM(amount) as total
-            FROM expenses
-            WHERE user_id = %s AND expense_date >= %s
-            GROUP BY DATE(expense_date)
-            ORDER BY date
-        """, (current_user.id, start_date.strftime('%Y-%m-%d')))
-        daily_data = cursor.fetchall()
+        # Merge in months that have been moved to the archive
+        archived_categories, archived_days, archived_unconverted = ({}, {}, []) if snapshot else \
+            partitions.archived_totals(current_user.id, start_date.date(),
+                                       current_user.home_currency, cursor)
+        flash_unconverted(sorted(set(unconverted) | set(archived_unconverted)))
+        if archived_categories:
+            by_category = {c['category_id']: c for c in category_data}
+            cursor.execute("SELECT * FROM categories")
+            for category in cursor.fetchall():
+                amount = archived_categories.get(category['category_id'])
+                if amount is None:
+                    continue
+                row = by_category.setdefault(category['category_id'], dict(
+                    category_id=category['category_id'], category_name=category['category_name'],
+                    icon=category['icon'], color=category['color'], total=0))
+                row['total'] += amount
+            category_data = sorted(by_category.values(), key=lambda c: c['total'], reverse=True)
+            
+            by_day = {d['date']: d['total'] for d in daily_data}
+            for day, amount in archived_days.items():
+                by_day[day] = by_day.get(day, 0) + amount
+            daily_data = [{'date': day, 'total': by_day[day]} for day in sorted(by_day)]
         
         total = sum(float(c['total']) for c in category_data) if category_data else 0
         
@@ -341,21 +515,36 @@ def budget():
     
     if conn:
         cursor = conn.cursor(dictionary=True)
+        month_start, month_end = current_month_range()
         
-        # Get budgets with spending
-        cursor.execute("""
-            SELECT b.*, c.category_name, c.icon, c.color,
-                   COALESCE((SELECT SUM(e.amount) FROM expenses e 
-                            WHERE e.category_id = b.category_id 
-                            AND e.user_id = b.user_id
-                            AND MONTH(e.expense_date) = b.month 
-                            AND YEAR(e.expense_date) = b.year), 0) as spent
-            FROM budgets b
-            JOIN categories c ON b.category_id = c.category_id
-            WHERE b.user_id = %s AND b.month = MONTH(CURRENT_DATE()) 
-            AND b.year = YEAR(CURRENT_DATE())
-        """, (current_user.id,))
-        budgets = cursor.fetchall()
+        # Get budgets with spending (only this month's budgets are listed)
+        if currency.FX_ENABLED:
+            cursor.execute("""
+                SELECT b.*, c.category_name, c.icon, c.color
+                FROM budgets b
+                JOIN categories c ON b.category_id = c.category_id
+                WHERE b.user_id = %s AND b.month = %s AND b.year = %s
+            """, (current_user.id, month_start.month, month_start.year))
+            budgets = cursor.fetchall()
+            stats, spending = snapshots.month_summary(cursor, current_user.id, month_start,
+                                                      month_end, current_user.home_currency)
+            flash_unconverted(stats['unconverted'])
+            spent = {c['category_id']: c['total'] for c in spending}
+            for b in budgets:
+                b['spent'] = spent.get(b['category_id'], 0)
+        else:
+            cursor.execute("""
+                SELECT b.*, c.category_name, c.icon, c.color,
+                       COALESCE((SELECT SUM(e.amount) FROM expenses e 
+                                WHERE e.category_id = b.category_id 
+                                AND e.user_id = b.user_id
+                                AND e.expense_date >= %s 
+                                AND e.expense_date < %s), 0) as spent
+                FROM budgets b
+                JOIN categories c ON b.category_id = c.category_id
+                WHERE b.user_id = %s AND b.month = %s AND b.year = %s
+            """, (month_start, month_end, current_user.id, month_start.month, month_start.year))
+            budgets = cursor.fetchall()
         
         cursor.execute("SELECT * FROM categories ORDER BY category_name")
         categories = cursor.fetchall()
@@ -395,32 +584,45 @@ def add_budget():
                 VALUES (%s, %s, %s, %s, %s)
             """, (current_user.id, category_id, amount, month, year))
         
+        http_cache.bump_user_version(cursor, current_user.id)
         conn.commit()
         cursor.close()
         conn.close()
+        notify_change('budget_saved', {
+            'category_id': category_id, 'budget_amount': float(amount),
+            'month': month, 'year': year
+        })
         flash('Budget saved!', 'success')
     
     return redirect(url_for('budget'))
 
 # API Endpoints for Charts
 @app.route('/api/chart_data')
+@http_cache.conditional_get
 @login_required
 def chart_data():
     conn = get_db_connection()
-    data = {'labels': [], 'values': [], 'colors': []}
+    data = {'labels': [], 'values': [], 'colors': [], 'unconverted': []}
     
     if conn:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT c.category_name, c.color, SUM(e.amount) as total
-            FROM expenses e
-            JOIN categories c ON e.category_id = c.category_id
-            WHERE e.user_id = %s AND MONTH(e.expense_date) = MONTH(CURRENT_DATE())
-            GROUP BY c.category_id
-            ORDER BY total DESC
-        """, (current_user.id,))
+        month_start, month_end = current_month_range()
+        if currency.FX_ENABLED:
+            stats, rows = snapshots.month_summary(cursor, current_user.id, month_start,
+                                                  month_end, current_user.home_currency)
+            data['unconverted'] = stats['unconverted']
+        else:
+            cursor.execute("""
+                SELECT c.category_name, c.color, SUM(e.amount) as total
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.category_id
+                WHERE e.user_id = %s AND e.expense_date >= %s AND e.expense_date < %s
+                GROUP BY c.category_id
+                ORDER BY total DESC
+            """, (current_user.id, month_start, month_end))
+            rows = cursor.fetchall()
         
-        for row in cursor.fetchall():
+        for row in rows:
             # Clean category name (remove emoji)
             name = row['category_name']
             if name and len(name) > 2 and ord(name[0]) > 127:
@@ -434,6 +636,92 @@ def chart_data():
     
     return jsonify(data)
 
+@app.route('/export')
+@login_required
+def export():
+    """Download all expenses as CSV, including archived months"""
+    conn = get_db_connection()
+    if not conn:
+        flash('Database unavailable', 'error')
+        return redirect(url_for('expenses'))
+    
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT category_id, category_name FROM categories")
+    category_names = {c['category_id']: c['category_name'] for c in cursor.fetchall()}
+    user_id = current_user.id
+    columns = ['expense_date', 'category_id', 'amount', 'description', 'payment_method', 'notes']
+    header = ['date', 'category', 'amount', 'description', 'payment_method', 'notes']
+    if currency.FX_ENABLED:
+        columns.append('currency')
+        header.append('currency')
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        
+        def write(row):
+            values = [row.get(col) for col in columns]
+            values[1] = category_names.get(values[1], '')
+            writer.writerow(values)
+        
+        def flush():
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return data
+        
+        try:
+            for row in partitions.iter_archived_expenses(user_id):
+                write(row)
+                if buffer.tell() > 65536:
+                    yield flush()
+            
+            cursor.execute("""
+                SELECT * FROM expenses WHERE user_id = %s
+                ORDER BY expense_date, expense_id
+            """, (user_id,))
+            for row in cursor:
+                write(row)
+                if buffer.tell() > 65536:
+                    yield flush()
+            yield flush()
+        finally:
+            cursor.close()
+            conn.close()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=expenses.csv'
+    return response
+
+@app.route('/api/snapshots/refresh', methods=['POST'])
+@login_required
+def refresh_snapshots():
+    """Recompute the current user's dashboard snapshots immediately"""
+    try:
+        snapshot_scheduler.refresh(current_user.id)
+    except (mysql.connector.Error, RuntimeError) as e:
+        # The scheduler retries on its own; the dashboard keeps live figures
+        print(f"❌ Snapshot refresh failed: {e}")
+        return jsonify({'refreshed': False, 'error': 'Database unavailable'}), 503
+    return jsonify({'refreshed': True})
+
+@app.route('/api/stream')
+@login_required
+def stream():
+    """Server-sent events with dashboard deltas for the current user"""
+    events = live_updates.open_stream(current_user.id)
+    if events is None:
+        # Thread-per-request server: keep threads for normal requests
+        response = Response('Live updates unavailable; poll /api/chart_data\n', 503,
+                            mimetype='text/plain')
+        response.headers['Retry-After'] = str(live_updates.RETRY_AFTER_SECONDS)
+        return response
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("🌐 EXPENSE TRACKER WEB APP")
@@ -0,0 +1,171 @@
+"""
+Benchmark - dashboard aggregate with currency conversion on vs off
+Loads a month of synthetic multi-currency expenses into scratch tables
+and times the dashboard's category query as it runs with conversion off
+(GROUP BY category) and on (GROUP BY category, currency and day), then
+the Python conversion pass in currency.converted_totals on top.
+Needs the MySQL server configured in config.DB_CONFIG.
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+from config import DB_CONFIG
+import currency
+import http_cache
+
+USERS = 200
+ROWS_PER_USER = 100
+CATEGORIES = 10
+CURRENCIES = ('USD', 'EUR', 'GBP', 'INR')
+RUNS = 200
+
+# The queries from snapshots.month_summary and currency.converted_totals,
+# pointed at the scratch tables
+PLAIN_QUERY = """
+    SELECT c.category_name, c.icon, c.color, SUM(e.amount) as total
+    FROM bench_fx_expenses e
+    JOIN bench_fx_categories c ON e.category_id = c.category_id
+    WHERE e.user_id = %s AND e.expense_date >= %s AND e.expense_date < %s
+    GROUP BY c.category_id
+    ORDER BY total DESC
+"""
+GROUPED_QUERY = """
+    SELECT e.category_id, c.category_name, c.icon, c.color, e.currency,
+           DATE(e.expense_date) as day,
+           SUM(e.amount) as total, COUNT(*) as count, MAX(e.amount) as max
+    FROM bench_fx_expenses e
+    LEFT JOIN bench_fx_categories c ON e.category_id = c.category_id
+    WHERE e.user_id = %s AND e.expense_date >= %s AND e.expense_date < %s
+    GROUP BY e.category_id, e.currency, DATE(e.expense_date)
+"""
+
+
+class ReplayCursor:
+    """Answers converted_totals' aggregate with rows already fetched from
+    the scratch table; the rates version lookup still goes to MySQL"""
+
+    def __init__(self, cursor, groups):
+        self._cursor = cursor
+        self._groups = groups
+        self._replay = False
+
+    def execute(self, sql, params=None):
+        self._replay = 'GROUP BY' in sql
+        if not self._replay:
+            self._cursor.execute(sql, params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._groups if self._replay else self._cursor.fetchall()
+
+
+def create_tables(cursor):
+    for table in ('bench_fx_expenses', 'bench_fx_categories'):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute("""
+        CREATE TABLE bench_fx_categories (
+            category_id INT PRIMARY KEY,
+            category_name VARCHAR(50) NOT NULL,
+            icon VARCHAR(10),
+            color VARCHAR(7)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE bench_fx_expenses (
+            expense_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            category_id INT NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            currency CHAR(3) NOT NULL DEFAULT 'USD',
+            expense_date DATE NOT NULL,
+            INDEX idx_user_date (user_id, expense_date)
+        )
+    """)
+
+
+def load(conn, cursor, month):
+    cursor.executemany("INSERT INTO bench_fx_categories VALUES (%s, %s, %s, %s)",
+                       [(i, f'Category {i}', '', '#000000') for i in range(CATEGORIES)])
+    rows = [(user_id, random.randrange(CATEGORIES), round(random.uniform(1, 200), 2),
+             random.choice(CURRENCIES), month + timedelta(days=random.randrange(28)))
+            for user_id in range(1, USERS + 1) for _ in range(ROWS_PER_USER)]
+    for start in range(0, len(rows), 5000):
+        cursor.executemany("INSERT INTO bench_fx_expenses "
+                           "(user_id, category_id, amount, currency, expense_date) "
+                           "VALUES (%s, %s, %s, %s, %s)", rows[start:start + 5000])
+    conn.commit()
+    return len(rows)
+
+
+def make_rates(cursor, month):
+    """Rates held in memory at the current rates version, so no reload is timed"""
+    fx = currency.FxRates(connect=lambda: None)
+    days = [month - timedelta(days=365) + timedelta(days=i) for i in range(400)]
+    for code, base in (('EUR', 1.08), ('GBP', 1.27), ('INR', 0.012)):
+        fx._dates[code] = days
+        fx._rates[code] = [Decimal(str(round(base * random.uniform(0.97, 1.03), 6))) for _ in days]
+    fx._version = currency.rates_version(cursor)
+    return fx
+
+
+def time_query(cursor, sql, month):
+    end = month + timedelta(days=32)
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        cursor.execute(sql, (random.randint(1, USERS), month, end))
+        cursor.fetchall()
+    return (time.perf_counter() - start) / RUNS * 1000
+
+
+def time_conversion(cursor, fx, month):
+    end = month + timedelta(days=32)
+    elapsed = 0
+    groups = 0
+    for _ in range(RUNS):
+        cursor.execute(GROUPED_QUERY, (random.randint(1, USERS), month, end))
+        rows = cursor.fetchall()
+        groups += len(rows)
+        start = time.perf_counter()
+        currency.converted_totals(ReplayCursor(cursor, rows), fx, 1, 'USD', month, end)
+        elapsed += time.perf_counter() - start
+    return elapsed / RUNS * 1000, groups / RUNS
+
+
+def main():
+    month = date.today().replace(day=1)
+    conn = mysql.connector.connect(**DB_CONFIG)
+    http_cache.ensure_table(conn)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        create_tables(cursor)
+        total = load(conn, cursor, month)
+        fx = make_rates(cursor, month)
+
+        plain = time_query(cursor, PLAIN_QUERY, month)
+        grouped = time_query(cursor, GROUPED_QUERY, month)
+        python, groups = time_conversion(cursor, fx, month)
+        print(f"{total:,} expenses, {ROWS_PER_USER} per user, "
+              f"{groups:.0f} (category, currency, day) groups per user")
+        print(f"conversion off: GROUP BY category                {plain:8.3f} ms")
+        print(f"conversion on:  GROUP BY category, currency, day {grouped:8.3f} ms")
+        print(f"                + Python conversion pass         {python:8.3f} ms "
+              f"(total {grouped + python:.3f} ms)")
+    finally:
+        for table in ('bench_fx_expenses', 'bench_fx_categories'):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark - group commit vs per-row commits
+Concurrent writers insert into a scratch table, either committing each
+row on its own connection or through the group-commit queue.
+Needs the MySQL server configured in config.DB_CONFIG.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+from config import DB_CONFIG
+from write_queue import GroupCommitQueue
+
+WRITERS = 32
+ROWS = 5000
+INSERT = "INSERT INTO bench_group_commit (user_id, amount) VALUES (%s, %s)"
+
+
+def connect():
+    return mysql.connector.connect(**DB_CONFIG)
+
+
+def run_sync():
+    local = threading.local()
+    commits = [0]
+    lock = threading.Lock()
+
+    def insert(i):
+        if not hasattr(local, 'conn'):
+            local.conn = connect()
+        cursor = local.conn.cursor()
+        cursor.execute(INSERT, (i % 100, 9.99))
+        local.conn.commit()
+        cursor.close()
+        with lock:
+            commits[0] += 1
+
+    with ThreadPoolExecutor(WRITERS) as pool:
+        list(pool.map(insert, range(ROWS)))
+    return commits[0]
+
+
+def run_grouped():
+    writer = GroupCommitQueue(connect, INSERT)
+    with ThreadPoolExecutor(WRITERS) as pool:
+        list(pool.map(lambda i: writer.insert((i % 100, 9.99)), range(ROWS)))
+    return writer.commits
+
+
+def main():
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS bench_group_commit")
+    cursor.execute("""
+        CREATE TABLE bench_group_commit (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL
+        )
+    """)
+    try:
+        for name, run in (('per-row commit', run_sync), ('group commit', run_grouped)):
+            start = time.perf_counter()
+            commits = run()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<15} {ROWS / elapsed:>8.0f} inserts/s  {commits:>5} commits")
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS bench_group_commit")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Benchmark - other routes during a login storm
+Serves a login route and an ordinary page from Flask behind a WSGI
+server with a fixed number of request threads (like gunicorn gthread),
+floods the login route and measures the latency of the ordinary page,
+with the KDF inline in the request thread and through the KDF pool
+
+The server runs in a child process per mode. The login route skips the
+users table lookup and the throttles (identical in both modes), so only
+password verification differs.
+
+Usage:
+    python benchmarks/bench_login_storm.py [--threads 8] [--storm 32] [--seconds 20]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+import http.client
+import subprocess
+import signal
+import statistics
+import argparse
+import threading
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from werkzeug.security import generate_password_hash
+import passwords
+
+PASSWORD = 'correct horse battery staple'
+PROBE_INTERVAL = 0.05
+
+
+# ==================== SERVER (child process) ====================
+
+class BoundedWSGIServer(WSGIServer):
+    """Hands each connection to one of ``threads`` request threads; the
+    rest wait in the accept backlog, as in a thread-per-request worker"""
+
+    request_queue_size = 1024
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._threads = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self._threads.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def create_app(mode, stored):
+    from flask import Flask, render_template_string, request
+    from werkzeug.security import check_password_hash
+
+    app = Flask(__name__)
+    rows = [{'description': f'Expense {i}', 'amount': i * 1.5} for i in range(50)]
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        password = request.form.get('password', '')
+        if mode == 'inline':
+            ok = check_password_hash(stored, password)
+        else:
+            try:
+                ok, _ = passwords.verify_password(stored, password)
+            except passwords.KdfBusy:
+                return 'busy', 503
+        return ('ok', 200) if ok else ('invalid', 401)
+
+    @app.route('/expenses')
+    def expenses():
+        return render_template_string(
+            '<ul>{% for e in rows %}<li>{{ e.description }}: {{ e.amount }}</li>{% endfor %}</ul>',
+            rows=rows)
+
+    return app
+
+
+def serve(port, mode, threads, stored):
+    app = create_app(mode, stored)
+    server = make_server('127.0.0.1', port, app,
+                         server_class=lambda *a, **k: BoundedWSGIServer(*a, threads=threads, **k),
+                         handler_class=QuietHandler)
+    server.serve_forever()
+
+
+# ==================== CLIENT ====================
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+    start = time.perf_counter()
+    conn.request(method, path, body=body, headers=headers)
+    status = conn.getresponse().status
+    conn.close()
+    return status, (time.perf_counter() - start) * 1000
+
+
+def wait_for_server(port):
+    for _ in range(100):
+        try:
+            return request(port, 'GET', '/expenses')
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit("benchmark server did not start")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_mode(mode, args, stored):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode,
+                               '--port', str(args.port), '--threads', str(args.threads),
+                               '--stored', stored],
+                              start_new_session=True)
+    try:
+        wait_for_server(args.port)
+        if mode != 'inline':
+            # Start the KDF workers before measuring
+            request(args.port, 'POST', '/login', f'password={PASSWORD}')
+
+        stop = threading.Event()
+        logins = []
+
+        def storm():
+            while not stop.is_set():
+                logins.append(request(args.port, 'POST', '/login', 'password=wrong+guess'))
+
+        stormers = []
+        if mode != 'idle':
+            stormers = [threading.Thread(target=storm) for _ in range(args.storm)]
+        for t in stormers:
+            t.start()
+        time.sleep(1)
+
+        # One user browsing while the storm runs
+        started = time.perf_counter()
+        latencies = []
+        while time.perf_counter() - started < args.seconds:
+            latencies.append(request(args.port, 'GET', '/expenses')[1])
+            time.sleep(PROBE_INTERVAL)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        for t in stormers:
+            t.join()
+    finally:
+        # The process group also holds the KDF forkserver and its workers
+        os.killpg(server.pid, signal.SIGKILL)
+        server.wait()
+
+    answered = [ms for status, ms in logins if status == 401]
+    busy = sum(1 for status, _ in logins if status == 503)
+    print(f"{mode:<7} /expenses n={len(latencies):<4} p50 {statistics.median(latencies):8.1f} ms  "
+          f"p99 {percentile(latencies, 0.99):8.1f} ms | logins "
+          f"{len(answered) / elapsed:6.1f}/s"
+          + (f", p50 {statistics.median(answered):7.1f} ms" if answered else "")
+          + f", 503 {busy}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8, help="request threads in the server")
+    parser.add_argument('--storm', type=int, default=32, help="concurrent login clients")
+    parser.add_argument('--seconds', type=float, default=20, help="measuring time per mode")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--stored', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port, args.serve, args.threads, args.stored)
+
+    stored = generate_password_hash(PASSWORD, method=passwords.PASSWORD_HASH_METHOD)
+    print(f"{args.threads} request threads, {args.storm} login clients, "
+          f"{passwords.KDF_WORKERS} KDF workers, {passwords.KDF_MAX_PENDING} pending, "
+          f"{passwords.KDF_QUEUE_TIMEOUT}s queue wait, {os.cpu_count()} CPU(s), "
+          f"{passwords.PASSWORD_HASH_METHOD}")
+    for mode in ('idle', 'inline', 'pool'):
+        run_mode(mode, args, stored)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark - current-month queries as history grows
+Loads synthetic history into a flat and a monthly-partitioned scratch
+table at 1x and 10x size and times the dashboard's current-month query.
+Needs the MySQL server configured in config.DB_CONFIG.
+"""
+
+from datetime import date, timedelta
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+from config import DB_CONFIG
+from partitions import add_months, month_start, partition_clause
+
+USERS = 200
+ROWS_PER_USER_MONTH = 30
+BASE_MONTHS = 12
+RUNS = 200
+
+QUERY = """
+    SELECT COALESCE(SUM(amount), 0), COUNT(*), COALESCE(MAX(amount), 0)
+    FROM {table}
+    WHERE user_id = %s AND expense_date >= %s AND expense_date < %s
+"""
+
+
+def create_tables(cursor, months):
+    first = add_months(month_start(date.today()), -months + 1)
+    clauses = [partition_clause(add_months(first, i)) for i in range(months + 1)]
+    clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    for table in ('bench_expenses_flat', 'bench_expenses_part'):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute("""
+        CREATE TABLE bench_expenses_flat (
+            expense_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            expense_date DATE NOT NULL,
+            INDEX idx_user_date (user_id, expense_date)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE bench_expenses_part (
+            expense_id INT AUTO_INCREMENT,
+            user_id INT NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            expense_date DATE NOT NULL,
+            PRIMARY KEY (expense_id, expense_date),
+            INDEX idx_user_date (user_id, expense_date)
+        ) PARTITION BY RANGE (TO_DAYS(expense_date)) (%s)
+    """ % ', '.join(clauses))
+    return first
+
+
+def load(conn, cursor, first, months):
+    rows = []
+    for i in range(months):
+        month = add_months(first, i)
+        days = (add_months(month, 1) - month).days
+        for user_id in range(1, USERS + 1):
+            for _ in range(ROWS_PER_USER_MONTH):
+                day = month + timedelta(days=random.randrange(days))
+                rows.append((user_id, round(random.uniform(1, 200), 2), day))
+    for table in ('bench_expenses_flat', 'bench_expenses_part'):
+        for start in range(0, len(rows), 5000):
+            cursor.executemany(f"INSERT INTO {table} (user_id, amount, expense_date) "
+                               "VALUES (%s, %s, %s)", rows[start:start + 5000])
+    conn.commit()
+    return len(rows)
+
+
+def time_query(cursor, table):
+    start_date = month_start(date.today())
+    end_date = add_months(start_date, 1)
+    sql = QUERY.format(table=table)
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        cursor.execute(sql, (random.randint(1, USERS), start_date, end_date))
+        cursor.fetchall()
+    return (time.perf_counter() - start) / RUNS * 1000
+
+
+def main():
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        for scale in (1, 10):
+            months = BASE_MONTHS * scale
+            first = create_tables(cursor, months)
+            total = load(conn, cursor, first, months)
+            flat = time_query(cursor, 'bench_expenses_flat')
+            part = time_query(cursor, 'bench_expenses_part')
+            print(f"{scale:>2}x history ({total:>9,} rows): "
+                  f"flat {flat:.3f} ms, partitioned {part:.3f} ms")
+    finally:
+        for table in ('bench_expenses_flat', 'bench_expenses_part'):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
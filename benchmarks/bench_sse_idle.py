@@ -0,0 +1,168 @@
+"""
+Benchmark - idle server-sent event streams
+Holds thousands of real, idle SSE connections open against a gevent
+WSGI server running live_updates, and reports the server's resident
+memory per connection and the time to deliver a delta to every one
+
+Requires gevent (pip install gevent). The server runs in a child
+process so its RSS is measured on its own.
+
+Usage:
+    python benchmarks/bench_sse_idle.py [--connections 5000] [--users 1000]
+"""
+
+from urllib.parse import parse_qs
+import subprocess
+import argparse
+import resource
+import socket
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ==================== SERVER (child process) ====================
+
+def _rss_bytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def serve(port):
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pywsgi import WSGIServer
+    sys.path.insert(0, ROOT)
+    import live_updates
+    # Disconnects are only noticed when the next keepalive write fails
+    live_updates.KEEPALIVE_SECONDS = 1
+
+    def application(environ, start_response):
+        path = environ['PATH_INFO']
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        if path == '/stream':
+            events = live_updates.open_stream(query['user'][0])
+            start_response('200 OK', [('Content-Type', 'text/event-stream'),
+                                      ('Cache-Control', 'no-cache')])
+            return _encoded(events)
+        if path == '/publish':
+            users = int(query['users'][0])
+            start = time.perf_counter()
+            for user_id in range(users):
+                live_updates.publish(user_id, 'expense_added', {'amount': 12.5})
+            body = {'seconds': time.perf_counter() - start}
+        else:
+            body = {'rss': _rss_bytes(), 'connections': live_updates.backend.connection_count(),
+                    'cooperative': live_updates.cooperative_server()}
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(body).encode()]
+
+    WSGIServer(('127.0.0.1', port), application, log=None).serve_forever()
+
+
+class _encoded:
+    """Encode frames while keeping the stream's close() for the server"""
+
+    def __init__(self, events):
+        self._events = events
+
+    def __iter__(self):
+        return (frame.encode() for frame in self._events)
+
+    def close(self):
+        self._events.close()
+
+
+# ==================== CLIENT ====================
+
+def _get(port, path):
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(f'GET {path} HTTP/1.0\r\nHost: bench\r\n\r\n'.encode())
+        data = b''
+        while chunk := sock.recv(65536):
+            data += chunk
+    return json.loads(data.split(b'\r\n\r\n', 1)[1])
+
+
+def _open_stream(port, user_id):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(f'GET /stream?user={user_id} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+    data = b''
+    while b'retry:' not in data:
+        data += sock.recv(4096)
+    return sock
+
+
+def _wait_for_server(port):
+    for _ in range(100):
+        try:
+            return _get(port, '/stats')
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit("benchmark server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if args.serve:
+        return serve(args.port)
+    if args.connections + 100 > hard:
+        raise SystemExit(f"open file limit {hard} is too low for {args.connections} connections")
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                               '--port', str(args.port)])
+    socks = []
+    try:
+        baseline = _wait_for_server(args.port)
+        print(f"Cooperative server:  {baseline['cooperative']}")
+
+        for i in range(args.connections):
+            socks.append(_open_stream(args.port, i % args.users))
+        time.sleep(0.5)
+        loaded = _get(args.port, '/stats')
+        used = loaded['rss'] - baseline['rss']
+        print(f"Open streams:        {loaded['connections']}")
+        print(f"Server RSS:          {baseline['rss'] / 2**20:.1f} MiB -> "
+              f"{loaded['rss'] / 2**20:.1f} MiB")
+        print(f"RSS / connection:    {used / args.connections / 1024:.1f} KiB")
+
+        start = time.perf_counter()
+        publish = _get(args.port, f'/publish?users={args.users}')
+        received = 0
+        for sock in socks:
+            data = b''
+            while b'expense_added' not in data:
+                data += sock.recv(4096)
+            received += 1
+        elapsed = time.perf_counter() - start
+        print(f"Publish to {args.users} users: {publish['seconds'] * 1000:.1f} ms in the server, "
+              f"{received} deliveries received in {elapsed * 1000:.1f} ms")
+
+        for sock in socks:
+            sock.close()
+        socks = []
+        time.sleep(3)
+        print(f"Open after close:    {_get(args.port, '/stats')['connections']}")
+    finally:
+        for sock in socks:
+            sock.close()
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
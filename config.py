@@ -0,0 +1,12 @@
+"""
+Expense Tracker - Configuration
+Database settings shared by the web app and the management commands
+"""
+
+# Database Configuration
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '12345',
+    'database': 'expense_tracker'
+}
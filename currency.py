@@ -0,0 +1,288 @@
+"""
+Expense Tracker - Multi-Currency
+Per-expense currencies, a locally imported date-indexed FX rate table
+and conversion of grouped aggregates into the user's home currency
+
+Rates files are CSV with a header row: date,currency,rate where rate is
+the value of one unit of ``currency`` in FX_BASE_CURRENCY on that date.
+
+Usage:
+    python currency.py migrate
+    python currency.py import rates.csv
+"""
+
+from bisect import bisect_right
+from datetime import date, datetime
+from decimal import Decimal
+import argparse
+import threading
+import logging
+import csv
+import os
+import re
+
+import http_cache
+
+CURRENCY_CODE = re.compile(r'^[A-Z]{3}$')
+
+FX_ENABLED = os.environ.get('MULTI_CURRENCY_ENABLED', '0') == '1'
+FX_BASE_CURRENCY = os.environ.get('FX_BASE_CURRENCY', 'USD')
+DEFAULT_HOME_CURRENCY = os.environ.get('HOME_CURRENCY', FX_BASE_CURRENCY)
+
+log = logging.getLogger('expense_tracker.currency')
+
+rates = None
+
+
+class FxRates:
+    """In-memory rate table; lookups bisect each currency's sorted dates.
+
+    A rate applies from its date until the next one, so weekends and
+    holidays use the last published rate. The table is reloaded whenever
+    the rates version in data_versions moves, i.e. after an import in
+    any process.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._dates = {}
+        self._rates = {}
+        self._version = None
+
+    def load(self):
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            cursor = conn.cursor()
+            version = rates_version(cursor)
+            cursor.execute("SELECT currency, rate_date, rate FROM fx_rates "
+                           "ORDER BY currency, rate_date")
+            dates, rates = {}, {}
+            for currency, rate_date, rate in cursor.fetchall():
+                dates.setdefault(currency, []).append(rate_date)
+                rates.setdefault(currency, []).append(Decimal(rate))
+            cursor.close()
+        finally:
+            conn.close()
+        with self._lock:
+            self._dates, self._rates = dates, rates
+            self._version = version
+
+    def _ensure_loaded(self, cursor=None):
+        """Reload if the rates changed; one primary-key lookup otherwise"""
+        if cursor is not None:
+            version = rates_version(cursor)
+        else:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                version_cursor = conn.cursor()
+                version = rates_version(version_cursor)
+                version_cursor.close()
+            finally:
+                conn.close()
+        if version != self._version:
+            self.load()
+
+    def rate(self, currency, day):
+        """Value of one unit of ``currency`` in the base currency on ``day``,
+        or None when no rate is known on or before it"""
+        if currency == FX_BASE_CURRENCY:
+            return Decimal(1)
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        # No rate was known yet before the first one, so leave it unconverted
+        index = bisect_right(dates, day) - 1
+        if index < 0:
+            return None
+        return self._rates[currency][index]
+
+    def known_code(self, value, home, cursor=None):
+        """Normalised currency code if it can be converted, else None"""
+        code = (value or home).strip().upper()
+        if code in (home, FX_BASE_CURRENCY):
+            return code
+        if not CURRENCY_CODE.match(code):
+            return None
+        self._ensure_loaded(cursor)
+        with self._lock:
+            return code if code in self._dates else None
+
+    def factors(self, pairs, home, cursor=None):
+        """Multipliers into ``home`` for each distinct (currency, day) pair,
+        None where either side has no rate"""
+        self._ensure_loaded(cursor)
+        factors = {}
+        with self._lock:
+            for currency, day in pairs:
+                if currency == home:
+                    factors[(currency, day)] = Decimal(1)
+                    continue
+                source, target = self.rate(currency, day), self.rate(home, day)
+                if source is None or target is None:
+                    log.warning('no FX rate for %s->%s on %s', currency, home, day)
+                    factors[(currency, day)] = None
+                else:
+                    factors[(currency, day)] = source / target
+        return factors
+
+
+def rates_version(cursor):
+    cursor.execute("SELECT version FROM data_versions WHERE scope = %s",
+                   (http_cache.RATES_SCOPE,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0
+    return row['version'] if isinstance(row, dict) else row[0]
+
+
+def home_amount(fx, amount, code, day, home, cursor=None):
+    """``amount`` of ``code`` on ``day`` expressed in ``home``, or None without a rate"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    elif isinstance(day, datetime):
+        day = day.date()
+    factor = fx.factors({(code, day)}, home, cursor)[(code, day)]
+    return None if factor is None else Decimal(str(amount)) * factor
+
+
+def init(connect):
+    """Create the shared rate cache, loaded lazily on first conversion"""
+    global rates
+    rates = FxRates(connect)
+
+
+def converted_totals(cursor, fx, user_id, home, start_date, end_date=None):
+    """Stats, category and daily totals in ``home`` currency.
+
+    SQL groups by category, currency and day, so conversion is one pass
+    over the groups and never touches individual expense rows. Groups
+    with no rate are left out and their currencies listed in
+    ``stats['unconverted']``.
+    """
+    sql = """
+        SELECT e.category_id, c.category_name, c.icon, c.color, e.currency,
+               DATE(e.expense_date) as day,
+               SUM(e.amount) as total, COUNT(*) as count, MAX(e.amount) as max
+        FROM expenses e
+        LEFT JOIN categories c ON e.category_id = c.category_id
+        WHERE e.user_id = %s AND e.expense_date >= %s
+    """
+    params = [user_id, start_date]
+    if end_date is not None:
+        sql += " AND e.expense_date < %s"
+        params.append(end_date)
+    sql += " GROUP BY e.category_id, e.currency, DATE(e.expense_date)"
+    cursor.execute(sql, params)
+    groups = cursor.fetchall()
+
+    factors = fx.factors({(g['currency'], g['day']) for g in groups}, home, cursor)
+
+    stats = {'total': Decimal(0), 'count': 0, 'avg': Decimal(0), 'max': Decimal(0)}
+    categories = {}
+    daily = {}
+    unconverted = set()
+    for g in groups:
+        factor = factors[(g['currency'], g['day'])]
+        if factor is None:
+            unconverted.add(g['currency'])
+            continue
+        total = g['total'] * factor
+        stats['total'] += total
+        stats['count'] += g['count']
+        stats['max'] = max(stats['max'], g['max'] * factor)
+        daily[g['day']] = daily.get(g['day'], 0) + total
+        if g['category_name'] is None:
+            continue
+        row = categories.setdefault(g['category_id'], {
+            'category_id': g['category_id'], 'category_name': g['category_name'],
+            'icon': g['icon'], 'color': g['color'], 'total': Decimal(0)})
+        row['total'] += total
+
+    if stats['count']:
+        stats['avg'] = stats['total'] / stats['count']
+    stats['unconverted'] = sorted(unconverted)
+    category_data = sorted(categories.values(), key=lambda c: c['total'], reverse=True)
+    daily_data = [{'date': day, 'total': daily[day]} for day in sorted(daily)]
+    return stats, category_data, daily_data
+
+
+def home_currency(cursor, user_id):
+    cursor.execute("SELECT home_currency FROM users WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    value = row and (row['home_currency'] if isinstance(row, dict) else row[0])
+    return value or DEFAULT_HOME_CURRENCY
+
+
+# ==================== MANAGEMENT COMMANDS ====================
+
+def migrate(conn):
+    """Add currency columns and the fx_rates table"""
+    cursor = conn.cursor()
+    for table, column in (('expenses', 'currency'), ('users', 'home_currency')):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (table, column))
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} CHAR(3) NOT NULL "
+                           f"DEFAULT '{DEFAULT_HOME_CURRENCY}'")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            currency CHAR(3) NOT NULL,
+            rate_date DATE NOT NULL,
+            rate DECIMAL(18, 8) NOT NULL,
+            PRIMARY KEY (currency, rate_date)
+        )
+    """)
+    conn.commit()
+    cursor.close()
+    http_cache.ensure_table(conn)
+    print("Currency columns and fx_rates table are in place")
+
+
+def import_rates(conn, path):
+    """Load a rates CSV into fx_rates, replacing rates for the same days"""
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [(r['currency'].strip().upper(), date.fromisoformat(r['date'].strip()),
+                 Decimal(r['rate'])) for r in csv.DictReader(f)]
+
+    cursor = conn.cursor()
+    for start in range(0, len(rows), 1000):
+        cursor.executemany("""
+            INSERT INTO fx_rates (currency, rate_date, rate) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE rate = VALUES(rate)
+        """, rows[start:start + 1000])
+    # Caches, ETags and snapshots of converted totals all key on this version
+    http_cache.bump_version(cursor, http_cache.RATES_SCOPE)
+    conn.commit()
+    cursor.close()
+    print(f"Imported {len(rows)} rate(s) from {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage currencies and FX rates")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help="add currency columns and the fx_rates table")
+    load = commands.add_parser('import', help="import rates from a CSV file")
+    load.add_argument('path')
+    args = parser.parse_args()
+
+    import mysql.connector
+    from config import DB_CONFIG
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if args.command == 'migrate':
+            migrate(conn)
+        else:
+            import_rates(conn, args.path)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
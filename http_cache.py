@@ -0,0 +1,191 @@
+"""
+Expense Tracker - HTTP Caching
+Per-user data versions, ETag/Last-Modified conditional GETs and
+response compression for the larger HTML/JSON payloads
+"""
+
+from flask import request, session, make_response
+from datetime import datetime, date, timezone
+from functools import wraps
+import hashlib
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = ('text/html', 'application/json')
+
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        scope VARCHAR(32) NOT NULL PRIMARY KEY,
+        version BIGINT NOT NULL,
+        updated_at DATETIME NOT NULL
+    )
+"""
+
+# Exchange rates feed every user's converted totals, so their version is
+# part of every user's version key
+RATES_SCOPE = 'fx'
+
+_connect = None
+
+
+def ensure_table(conn):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_TABLE)
+    conn.commit()
+    cursor.close()
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def bump_version(cursor, scope):
+    """Bump a data version; call inside the write's own transaction"""
+    cursor.execute("""
+        INSERT INTO data_versions (scope, version, updated_at)
+        VALUES (%s, 1, UTC_TIMESTAMP())
+        ON DUPLICATE KEY UPDATE version = version + 1, updated_at = UTC_TIMESTAMP()
+    """, (scope,))
+
+
+def bump_user_version(cursor, user_id):
+    bump_version(cursor, user_scope(user_id))
+
+
+def version_key(user_version, rates_version):
+    return f'{user_version or 0}.{rates_version or 0}'
+
+
+def current_version(cursor, user_id):
+    """Version key and last change time (UTC) for a user's data"""
+    scope = user_scope(user_id)
+    cursor.execute("SELECT scope, version, updated_at FROM data_versions WHERE scope IN (%s, %s)",
+                   (scope, RATES_SCOPE))
+    rows = {row['scope']: row for row in cursor.fetchall()}
+    user, rates = rows.get(scope), rows.get(RATES_SCOPE)
+    version = version_key(user and user['version'], rates and rates['version'])
+    changed_at = max((row['updated_at'] for row in rows.values()), default=None)
+    return version, changed_at and changed_at.replace(tzinfo=timezone.utc)
+
+
+def _etag_for(user_id, version):
+    # Period-relative queries (this month, last 7 days) change at midnight
+    key = '|'.join((str(user_id), version, date.today().isoformat(), request.full_path))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _last_modified(changed_at):
+    midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    midnight = midnight.astimezone(timezone.utc)
+    return max(changed_at, midnight) if changed_at else midnight
+
+
+def _matching_etag(etag, last_modified):
+    """Return the validator the client already holds, or None if stale"""
+    if request.if_none_match:
+        for tag in (etag, etag + '-gzip', etag + '-br'):
+            if request.if_none_match.contains(tag):
+                return tag
+        return None
+    if request.if_modified_since and request.if_modified_since >= last_modified:
+        return etag
+    return None
+
+
+def _load_version(user_id):
+    conn = _connect() if _connect else None
+    if conn is None:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        version = current_version(cursor, user_id)
+        cursor.close()
+        return version
+    finally:
+        conn.close()
+
+
+def conditional_get(view):
+    """Answer revalidations with 304 after a single primary-key lookup.
+
+    The version lives in the data_versions table and is bumped in the
+    same transaction as every write, so all workers agree on it. Applied
+    outside ``login_required`` so a fresh poll skips the user loader
+    query as well; the user id comes from the signed session.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        user_id = session.get('_user_id')
+        # Pending flash messages must reach a rendered page
+        if not user_id or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        loaded = _load_version(user_id)
+        if loaded is None:
+            return view(*args, **kwargs)
+        version, changed_at = loaded
+        etag = _etag_for(user_id, version)
+        last_modified = _last_modified(changed_at)
+
+        matched = _matching_etag(etag, last_modified)
+        if matched:
+            response = make_response('', 304)
+            response.set_etag(matched)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated
+
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """Compress large HTML/JSON bodies with brotli or gzip"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _accepted_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+
+    # Encoded representations need their own strong validator
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+
+def init_app(app, connect):
+    """Register response compression and the connection used for version lookups"""
+    global _connect
+    _connect = connect
+    app.after_request(compress_response)
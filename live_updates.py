@@ -0,0 +1,202 @@
+"""
+Expense Tracker - Live Updates
+Per-user pub/sub for dashboard deltas, streamed to browsers as
+server-sent events
+
+Events published after a write commits:
+    expense_added    {expense_id, category_id, category_name, amount, currency,
+                      original_amount, original_currency, description, expense_date}
+    expense_deleted  {expense_id, category_id, amount, currency,
+                      original_amount, original_currency, expense_date}
+    budget_saved     {category_id, budget_amount, month, year}
+    resync           {}  - the subscriber fell behind, or an amount had no
+                           exchange rate; refetch /api/chart_data
+
+``amount`` is in the user's home currency (``currency``), the same unit
+as the dashboard totals; ``original_*`` is what was entered.
+
+Deployment: an open stream holds its worker for as long as the browser
+keeps it, so streams need a cooperative (greenlet) server, e.g.
+
+    gunicorn -k gevent --worker-connections 10000 app:app
+
+Under a thread-per-request server only SSE_MAX_BLOCKING_STREAMS streams
+are admitted per process and the rest get 503, leaving the remaining
+threads for ordinary requests; those clients poll /api/chart_data.
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+import threading
+import queue
+import json
+import sys
+import os
+
+KEEPALIVE_SECONDS = 15
+MAX_PENDING = 100
+MAX_BLOCKING_STREAMS = int(os.environ.get('SSE_MAX_BLOCKING_STREAMS', 4))
+RETRY_AFTER_SECONDS = 60
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def encode_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, default=_json_default)}\n\n'
+
+
+class Subscription:
+    """One open stream; holds pre-encoded SSE frames until sent"""
+
+    __slots__ = ('user_id', '_queue')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        # queue.Queue waits on threading primitives, which gevent/eventlet patch
+        self._queue = queue.Queue()
+
+    def put(self, frame):
+        if self._queue.qsize() >= MAX_PENDING:
+            # Drop the backlog; the client reloads the full aggregate instead
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            frame = encode_event('resync', {})
+        self._queue.put(frame)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InProcessBackend:
+    """Fan-out to subscribers of this process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        sub = Subscription(str(user_id))
+        with self._lock:
+            self._subscribers.setdefault(sub.user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+
+    def publish(self, user_id, frame):
+        with self._lock:
+            subs = list(self._subscribers.get(str(user_id), ()))
+        for sub in subs:
+            sub.put(frame)
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+class RedisBackend(InProcessBackend):
+    """Relay frames through Redis pub/sub so every worker sees every write.
+
+    Each process keeps one listener thread and fans out locally, so open
+    streams cost no Redis connections of their own.
+    """
+
+    CHANNEL_PREFIX = 'expense_tracker:live:'
+
+    def __init__(self, url='redis://localhost:6379/0'):
+        super().__init__()
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.CHANNEL_PREFIX + '*')
+        threading.Thread(target=self._listen, args=(pubsub,), daemon=True).start()
+
+    def _listen(self, pubsub):
+        for message in pubsub.listen():
+            user_id = message['channel'].decode()[len(self.CHANNEL_PREFIX):]
+            super().publish(user_id, message['data'].decode())
+
+    def publish(self, user_id, frame):
+        self._redis.publish(self.CHANNEL_PREFIX + str(user_id), frame)
+
+
+backend = InProcessBackend()
+
+
+def set_backend(new_backend):
+    """Swap the pub/sub backend, e.g. ``set_backend(RedisBackend(url))``"""
+    global backend
+    backend = new_backend
+
+
+def publish(user_id, event, data):
+    backend.publish(user_id, encode_event(event, data))
+
+
+def cooperative_server():
+    """True when gevent or eventlet has patched threading in this process"""
+    if 'gevent.monkey' in sys.modules:
+        if sys.modules['gevent.monkey'].is_module_patched('threading'):
+            return True
+    if 'eventlet.patcher' in sys.modules:
+        if sys.modules['eventlet.patcher'].is_monkey_patched('thread'):
+            return True
+    return False
+
+
+_blocking_slots = threading.BoundedSemaphore(MAX_BLOCKING_STREAMS)
+
+
+class EventStream:
+    """SSE frames for one subscription; the WSGI server calls close()
+    when the client disconnects, even if iteration never started"""
+
+    def __init__(self, sub, slot=None):
+        self._sub = sub
+        self._slot = slot
+        self._started = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        if not self._started:
+            self._started = True
+            return f'retry: {KEEPALIVE_SECONDS * 1000}\n\n'
+        frame = self._sub.get(timeout=KEEPALIVE_SECONDS)
+        return frame if frame is not None else ': keepalive\n\n'
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        backend.unsubscribe(self._sub)
+        if self._slot is not None:
+            self._slot.release()
+
+
+def open_stream(user_id):
+    """Subscribe one client, or return None when no blocking slot is free"""
+    slot = None
+    if not cooperative_server():
+        if not _blocking_slots.acquire(blocking=False):
+            return None
+        slot = _blocking_slots
+    return EventStream(backend.subscribe(user_id), slot)
@@ -0,0 +1,383 @@
+"""
+Expense Tracker - Expense Partitions
+Monthly RANGE partitioning of the expenses table and archival of cold
+months into gzip NDJSON files that reports and exports can still read
+
+Each archived month is a directory of per-user-bucket files, so reading
+one user's history touches 1/ARCHIVE_BUCKETS of the archive:
+    archive/2024-01/manifest.json
+    archive/2024-01/bucket-007.ndjson.gz
+
+The manifest's state is "archived" while the month's partition is still
+live and becomes "dropped" once the partition is gone; readers only use
+dropped months, so no month is ever counted from both places.
+
+Usage:
+    python partitions.py init [--drop-foreign-keys]
+    python partitions.py ensure [--months-ahead 3]
+    python partitions.py archive --keep-months 24
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+
+import currency
+
+ARCHIVE_DIR = os.environ.get('EXPENSE_ARCHIVE_DIR',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_BUCKETS = int(os.environ.get('EXPENSE_ARCHIVE_BUCKETS', 64))
+MONTHS_AHEAD = 3
+
+_PARTITION_NAME = re.compile(r'^p(\d{4})(\d{2})$')
+_ARCHIVE_NAME = re.compile(r'^(\d{4})-(\d{2})$')
+
+
+# ==================== MONTH HELPERS ====================
+
+def add_months(month, count):
+    """First day of the month ``count`` months after ``month``"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def partition_name(month):
+    return f'p{month.year:04d}{month.month:02d}'
+
+
+def partition_clause(month):
+    upper = add_months(month, 1).isoformat()
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{upper}'))"
+
+
+# ==================== ARCHIVE READING ====================
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f'{month.year:04d}-{month.month:02d}')
+
+
+def bucket_name(bucket):
+    return f'bucket-{bucket:03d}.ndjson.gz'
+
+
+def read_manifest(month):
+    """Manifest of an archived month, or None if there is no complete archive"""
+    try:
+        with open(os.path.join(archive_path(month), 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _user_bucket_path(month, user_id):
+    """File holding ``user_id``'s rows for an archived month, or None"""
+    buckets = read_manifest(month)['buckets']
+    path = os.path.join(archive_path(month), bucket_name(int(user_id) % buckets))
+    return path if os.path.exists(path) else None
+
+
+def archived_months(start_date=None, end_date=None):
+    """Months whose partition has been dropped, optionally limited to a date range"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+
+    months = []
+    for name in os.listdir(ARCHIVE_DIR):
+        match = _ARCHIVE_NAME.match(name)
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        if start_date and add_months(month, 1) <= start_date:
+            continue
+        if end_date and month > end_date:
+            continue
+        manifest = read_manifest(month)
+        if manifest is None or manifest.get('state') != 'dropped':
+            continue
+        months.append(month)
+    return sorted(months)
+
+
+def iter_archived_expenses(user_id, start_date=None, end_date=None):
+    """Yield archived expense rows for one user in date order"""
+    for month in archived_months(start_date, end_date):
+        path = _user_bucket_path(month, user_id)
+        if path is None:
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                if str(row['user_id']) != str(user_id):
+                    continue
+                row['expense_date'] = date.fromisoformat(row['expense_date'])
+                if start_date and row['expense_date'] < start_date:
+                    continue
+                if end_date and row['expense_date'] > end_date:
+                    continue
+                row['amount'] = Decimal(row['amount'])
+                yield row
+
+
+def archived_totals(user_id, start_date, home=None, cursor=None):
+    """Per-category and per-day totals from archived months since ``start_date``,
+    plus the currencies left out for lack of a rate; rates are read through
+    ``cursor`` when given"""
+    groups = {}
+    for row in iter_archived_expenses(user_id, start_date):
+        key = (row['category_id'], row.get('currency', home), row['expense_date'])
+        groups[key] = groups.get(key, 0) + row['amount']
+
+    factors = {}
+    if currency.FX_ENABLED and home:
+        factors = currency.rates.factors({(cur, day) for _, cur, day in groups}, home,
+                                          cursor)
+
+    by_category = {}
+    by_day = {}
+    unconverted = set()
+    for (category_id, cur, day), amount in groups.items():
+        factor = factors.get((cur, day), 1)
+        if factor is None:
+            unconverted.add(cur)
+            continue
+        amount *= factor
+        by_category[category_id] = by_category.get(category_id, 0) + amount
+        by_day[day] = by_day.get(day, 0) + amount
+    return by_category, by_day, sorted(unconverted)
+
+
+# ==================== MANAGEMENT COMMANDS ====================
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def existing_partitions(conn):
+    """Months that currently have a pYYYYMM partition"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expenses'
+        AND PARTITION_NAME IS NOT NULL
+    """)
+    months = []
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    cursor.close()
+    return sorted(months)
+
+
+def init_partitions(conn, months_ahead=MONTHS_AHEAD, drop_foreign_keys=False):
+    """Convert the flat expenses table to monthly partitions"""
+    if existing_partitions(conn):
+        print("expenses is already partitioned")
+        return
+
+    cursor = conn.cursor()
+
+    # InnoDB cannot partition tables that have foreign keys
+    cursor.execute("""
+        SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expenses'
+        AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+    """)
+    foreign_keys = [name for (name,) in cursor.fetchall()]
+    if foreign_keys and not drop_foreign_keys:
+        raise SystemExit("expenses has foreign keys (%s); rerun with --drop-foreign-keys"
+                         % ', '.join(foreign_keys))
+    for name in foreign_keys:
+        cursor.execute(f"ALTER TABLE expenses DROP FOREIGN KEY `{name}`")
+
+    cursor.execute("SELECT MIN(expense_date) FROM expenses")
+    oldest = cursor.fetchone()[0] or date.today()
+    first = month_start(oldest)
+    last = add_months(month_start(date.today()), months_ahead)
+
+    clauses = []
+    month = first
+    while month <= last:
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expenses'
+        AND INDEX_NAME = 'idx_user_date'
+    """)
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE expenses ADD INDEX idx_user_date (user_id, expense_date)")
+
+    # Every unique key must contain the partitioning column
+    cursor.execute("""
+        ALTER TABLE expenses
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (expense_id, expense_date)
+    """)
+    cursor.execute("ALTER TABLE expenses PARTITION BY RANGE (TO_DAYS(expense_date)) (%s)"
+                   % ', '.join(clauses))
+    cursor.close()
+    print(f"Partitioned expenses into {len(clauses) - 1} monthly partitions")
+
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD):
+    """Split pmax so partitions exist ``months_ahead`` months into the future"""
+    months = existing_partitions(conn)
+    if not months:
+        raise SystemExit("expenses is not partitioned; run 'init' first")
+
+    target = add_months(month_start(date.today()), months_ahead)
+    month = add_months(months[-1], 1)
+    clauses = []
+    while month <= target:
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+
+    if clauses:
+        clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        cursor = conn.cursor()
+        cursor.execute("ALTER TABLE expenses REORGANIZE PARTITION pmax INTO (%s)"
+                       % ', '.join(clauses))
+        cursor.close()
+    print(f"Created {max(len(clauses) - 1, 0)} partition(s) up to {target:%Y-%m}")
+
+
+def _write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, 'manifest.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, 'manifest.json'))
+
+
+def _partition_rows(cursor, month):
+    cursor.execute(f"SELECT COUNT(*) as count FROM expenses PARTITION ({partition_name(month)})")
+    return cursor.fetchone()['count']
+
+
+def _write_archive(cursor, month):
+    """Write one live partition to a fresh, not yet readable archive"""
+    path = archive_path(month)
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    cursor.execute(f"SELECT * FROM expenses PARTITION ({partition_name(month)}) "
+                   "ORDER BY user_id, expense_date, expense_id")
+    count = 0
+    files = {}
+    try:
+        for row in cursor:
+            bucket = int(row['user_id']) % ARCHIVE_BUCKETS
+            if bucket not in files:
+                files[bucket] = gzip.open(os.path.join(tmp_path, bucket_name(bucket)),
+                                          'wt', encoding='utf-8')
+            files[bucket].write(json.dumps(row, default=_json_default) + '\n')
+            count += 1
+    finally:
+        for f in files.values():
+            f.close()
+    for name in os.listdir(tmp_path):
+        with open(os.path.join(tmp_path, name), 'rb') as f:
+            os.fsync(f.fileno())
+    manifest = {'buckets': ARCHIVE_BUCKETS, 'rows': count, 'state': 'archived'}
+    _write_manifest(tmp_path, manifest)
+
+    # A leftover from an interrupted run is unreadable (not "dropped"); replace it
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def _mark_dropped(month, manifest):
+    _write_manifest(archive_path(month), dict(manifest, state='dropped'))
+
+
+def archive_partitions(conn, keep_months):
+    """Write months older than ``keep_months`` to the archive and drop them"""
+    cursor = conn.cursor(dictionary=True)
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    live = existing_partitions(conn)
+
+    # A run that died between DROP PARTITION and the manifest update
+    for name in os.listdir(ARCHIVE_DIR):
+        match = _ARCHIVE_NAME.match(name)
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        manifest = read_manifest(month)
+        if manifest and manifest.get('state') != 'dropped' and month not in live:
+            _mark_dropped(month, manifest)
+            print(f"Marked {month:%Y-%m} as dropped")
+
+    for month in live:
+        if month >= cutoff:
+            break
+
+        path = archive_path(month)
+        manifest = read_manifest(month)
+        # Reuse an archive left by an interrupted run if it still matches
+        if (manifest is None or manifest.get('state') == 'dropped'
+                or manifest['rows'] != _partition_rows(cursor, month)):
+            manifest = _write_archive(cursor, month)
+
+        # Rows inserted into the month while it was being written would be lost
+        if _partition_rows(cursor, month) != manifest['rows']:
+            print(f"Skipped {month:%Y-%m}: rows changed while archiving; rerun to retry")
+            continue
+
+        cursor.execute(f"ALTER TABLE expenses DROP PARTITION {partition_name(month)}")
+        _mark_dropped(month, manifest)
+        print(f"Archived {manifest['rows']} expense(s) from {month:%Y-%m} to {path}")
+
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage expenses table partitions")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init = commands.add_parser('init', help="partition the expenses table by month")
+    init.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD)
+    init.add_argument('--drop-foreign-keys', action='store_true')
+
+    ensure = commands.add_parser('ensure', help="create future partitions ahead of time")
+    ensure.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD)
+
+    archive = commands.add_parser('archive', help="archive and drop cold partitions")
+    archive.add_argument('--keep-months', type=int, required=True)
+
+    args = parser.parse_args()
+
+    import mysql.connector
+    from config import DB_CONFIG
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if args.command == 'init':
+            init_partitions(conn, args.months_ahead, args.drop_foreign_keys)
+        elif args.command == 'ensure':
+            ensure_partitions(conn, args.months_ahead)
+        else:
+            archive_partitions(conn, args.keep_months)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
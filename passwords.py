@@ -0,0 +1,117 @@
+"""
+Expense Tracker - Password Hashing
+Runs the password KDF in a bounded process pool so logins cannot hold
+request workers (and the GIL) while hashing
+
+Workers start from a forkserver (spawn where unavailable), never by
+forking the threaded server. Like any spawned process they import the
+main module as ``__mp_main__``; app.py skips its database setup there.
+"""
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import os
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', 2))
+# Request threads waiting on a hash are not serving anything else, so keep
+# KDF_MAX_PENDING well below the server's thread count and turn the rest
+# away at once instead of letting them queue
+KDF_MAX_PENDING = int(os.environ.get('KDF_MAX_PENDING', 4))
+KDF_QUEUE_TIMEOUT = float(os.environ.get('KDF_QUEUE_TIMEOUT', 0))
+KDF_TIMEOUT = 10
+
+
+class KdfBusy(Exception):
+    """Raised when too many hashes are queued or the pool cannot answer in time"""
+
+
+def needs_rehash(stored_hash):
+    """True if the hash was made with other cost parameters than configured"""
+    method, _, rest = stored_hash.partition('$')
+    salt = rest.partition('$')[0]
+    return method != PASSWORD_HASH_METHOD or len(salt) != PASSWORD_SALT_LENGTH
+
+
+# Run inside the worker processes
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(stored_hash, password, method, salt_length, rehash):
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if rehash:
+        return True, _hash(password, method, salt_length)
+    return True, None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(KDF_MAX_PENDING)
+
+
+def _mp_context():
+    # Forking a threaded server can copy held locks into the child, so start
+    # workers from a clean forkserver that preloads only this module
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=KDF_WORKERS, mp_context=_mp_context())
+    return _pool
+
+
+def _discard_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=KDF_QUEUE_TIMEOUT):
+        raise KdfBusy()
+    try:
+        for retry in (True, False):
+            pool = _get_pool()
+            try:
+                future = pool.submit(fn, *args)
+                return future.result(KDF_TIMEOUT)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); replace the pool and retry once
+                _discard_pool(pool)
+                if not retry:
+                    raise KdfBusy()
+            except FuturesTimeout:
+                future.cancel()
+                raise KdfBusy()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    return _run(_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+
+
+def verify_password(stored_hash, password):
+    """Check a password; returns ``(ok, new_hash)``.
+
+    ``new_hash`` is set when the stored hash used outdated cost
+    parameters and should replace it.
+    """
+    return _run(_verify, stored_hash, password, PASSWORD_HASH_METHOD,
+                PASSWORD_SALT_LENGTH, needs_rehash(stored_hash))
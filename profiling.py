@@ -0,0 +1,236 @@
+"""
+Expense Tracker - Query Profiling
+Per-request database instrumentation: query count, DB time, rows fetched,
+pool wait, slow-query log and N+1 detection
+"""
+
+from flask import g, request, has_request_context, Response, abort
+from collections import Counter, defaultdict
+import threading
+import hmac
+import logging
+import time
+import re
+import os
+
+# Profiling Configuration
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+# /metrics answers loopback (or these addresses) and bearer-token holders only.
+# Behind a reverse proxy on the same host every client looks like loopback:
+# set METRICS_ALLOWED_IPS to an empty string there and rely on the token.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = {ip.strip() for ip in
+                       os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+                       if ip.strip()}
+
+slow_query_log = logging.getLogger('expense_tracker.slow_query')
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Collapse literals and whitespace so equivalent statements compare equal"""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class RequestStats:
+    """DB counters collected while serving a single request"""
+
+    __slots__ = ('queries', 'db_time', 'rows', 'pool_wait', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+        self.statements = Counter()
+
+
+class MetricsRegistry:
+    """Process-wide, per-route totals rendered in Prometheus text format"""
+
+    FIELDS = ('requests', 'queries', 'db_seconds', 'rows', 'pool_wait_seconds',
+              'slow_queries', 'n_plus_one')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+
+    def increment(self, route, field, value=1):
+        with self._lock:
+            self._routes[route][field] += value
+
+    def record(self, route, stats, n_plus_one):
+        with self._lock:
+            totals = self._routes[route]
+            totals['requests'] += 1
+            totals['queries'] += stats.queries
+            totals['db_seconds'] += stats.db_time
+            totals['rows'] += stats.rows
+            totals['pool_wait_seconds'] += stats.pool_wait
+            totals['n_plus_one'] += n_plus_one
+
+    def render(self):
+        with self._lock:
+            snapshot = {route: dict(totals) for route, totals in self._routes.items()}
+
+        lines = []
+        for field in self.FIELDS:
+            name = f'expense_tracker_{field}_total'
+            lines.append(f'# TYPE {name} counter')
+            for route, totals in sorted(snapshot.items()):
+                lines.append(f'{name}{{route="{route}"}} {totals[field]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+collectors = []
+
+
+def register_collector(collect):
+    """Add a callable returning extra Prometheus lines for /metrics"""
+    collectors.append(collect)
+
+
+def _current_stats():
+    if not PROFILING_ENABLED or not has_request_context():
+        return None
+    return g.get('db_stats')
+
+
+def _route_name():
+    return request.endpoint or 'unknown'
+
+
+class ProfiledCursor:
+    """Cursor proxy that times execute() and counts fetched rows"""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            statement = normalize_sql(operation)
+            self._stats.queries += 1
+            self._stats.db_time += elapsed
+            self._stats.statements[statement] += 1
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                metrics.increment(_route_name(), 'slow_queries')
+                slow_query_log.warning('slow query %.1fms route=%s sql=%s',
+                                       elapsed * 1000, _route_name(), statement)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._stats.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProfiledConnection:
+    """Connection proxy whose cursors report into the request stats"""
+
+    def __init__(self, conn, stats):
+        self._conn = conn
+        self._stats = stats
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self._conn.cursor(*args, **kwargs), self._stats)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def checkout(pool):
+    """Get a connection from the pool, recording wait time and wrapping it"""
+    stats = _current_stats()
+    if stats is None:
+        return pool.get_connection()
+
+    start = time.perf_counter()
+    conn = pool.get_connection()
+    stats.pool_wait += time.perf_counter() - start
+    return ProfiledConnection(conn, stats)
+
+
+def _repeated_statements(stats):
+    return [(sql, count) for sql, count in stats.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD]
+
+
+def metrics_allowed():
+    """True if the caller may scrape /metrics"""
+    if request.remote_addr in METRICS_ALLOWED_IPS:
+        return True
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+    return False
+
+
+def init_app(app):
+    """Register request hooks and the /metrics endpoint"""
+
+    @app.before_request
+    def start_profiling():
+        if PROFILING_ENABLED:
+            g.db_stats = RequestStats()
+
+    @app.after_request
+    def finish_profiling(response):
+        stats = _current_stats()
+        if stats is None:
+            return response
+
+        route = _route_name()
+        repeated = _repeated_statements(stats)
+        for sql, count in repeated:
+            slow_query_log.warning('possible N+1: route=%s issued %d x %s',
+                                   route, count, sql)
+        metrics.record(route, stats, len(repeated))
+
+        response.headers.add('Server-Timing',
+                             f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"')
+        response.headers.add('Server-Timing',
+                             f'pool;dur={stats.pool_wait * 1000:.2f}')
+        response.headers.add('Server-Timing', f'rows;desc="{stats.rows}"')
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        if not metrics_allowed():
+            abort(403)
+        lines = [line for collect in collectors for line in collect()]
+        body = metrics.render() + ''.join(line + '\n' for line in lines)
+        return Response(body, mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,368 @@
+"""
+Expense Tracker - Dashboard Snapshots
+Precomputed per-user monthly figures and last-7-days breakdown, refreshed
+by a background scheduler after writes (debounced) and at day rollover
+
+Each snapshot records the user's data version (see http_cache) it was
+built from; a lookup only serves it while that version is still current.
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import threading
+import logging
+import json
+import time
+import os
+
+import http_cache
+import partitions
+import currency
+
+SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get('SNAPSHOT_DEBOUNCE_SECONDS', 2))
+ROLLOVER_CHECK_SECONDS = 60
+
+log = logging.getLogger('expense_tracker.snapshots')
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS report_snapshots (
+        user_id INT NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        period_key DATE NOT NULL,
+        payload MEDIUMTEXT NOT NULL,
+        data_version VARCHAR(64) NOT NULL DEFAULT '',
+        refreshed_at DATETIME NOT NULL,
+        PRIMARY KEY (user_id, kind)
+    )
+"""
+
+
+def ensure_table(conn):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_TABLE)
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'report_snapshots'
+        AND COLUMN_NAME = 'data_version'
+    """)
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE report_snapshots ADD COLUMN data_version "
+                       "VARCHAR(64) NOT NULL DEFAULT '' AFTER payload")
+    conn.commit()
+    cursor.close()
+
+
+# ==================== AGGREGATE QUERIES ====================
+
+def month_summary(cursor, user_id, month_start, month_end, home=None):
+    """Stats and category totals for the dashboard month"""
+    if currency.FX_ENABLED:
+        home = home or currency.home_currency(cursor, user_id)
+        stats, category_data, _ = currency.converted_totals(
+            cursor, currency.rates, user_id, home, month_start, month_end)
+        return stats, category_data
+
+    cursor.execute("""
+        SELECT
+            COALESCE(SUM(amount), 0) as total,
+            COUNT(*) as count,
+            COALESCE(AVG(amount), 0) as avg,
+            COALESCE(MAX(amount), 0) as max
+        FROM expenses
+        WHERE user_id = %s AND expense_date >= %s AND expense_date < %s
+    """, (user_id, month_start, month_end))
+    stats = cursor.fetchone()
+
+    cursor.execute("""
+        SELECT c.category_name, c.icon, c.color, SUM(e.amount) as total
+        FROM expenses e
+        JOIN categories c ON e.category_id = c.category_id
+        WHERE e.user_id = %s AND e.expense_date >= %s AND e.expense_date < %s
+        GROUP BY c.category_id
+        ORDER BY total DESC
+    """, (user_id, month_start, month_end))
+    return stats, cursor.fetchall()
+
+
+def period_totals(cursor, user_id, start_date, home=None):
+    """Category and daily totals since ``start_date`` for reports, plus
+    the currencies left out for lack of a rate"""
+    if currency.FX_ENABLED:
+        home = home or currency.home_currency(cursor, user_id)
+        stats, category_data, daily_data = currency.converted_totals(
+            cursor, currency.rates, user_id, home, start_date.strftime('%Y-%m-%d'))
+        return category_data, daily_data, stats['unconverted']
+
+    cursor.execute("""
+        SELECT c.category_id, c.category_name, c.icon, c.color, SUM(e.amount) as total
+        FROM expenses e
+        JOIN categories c ON e.category_id = c.category_id
+        WHERE e.user_id = %s AND e.expense_date >= %s
+        GROUP BY c.category_id
+        ORDER BY total DESC
+    """, (user_id, start_date.strftime('%Y-%m-%d')))
+    category_data = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT DATE(expense_date) as date, SUM(amount) as total
+        FROM expenses
+        WHERE user_id = %s AND expense_date >= %s
+        GROUP BY DATE(expense_date)
+        ORDER BY date
+    """, (user_id, start_date.strftime('%Y-%m-%d')))
+    return category_data, cursor.fetchall(), []
+
+
+def week_start():
+    return datetime.now() - timedelta(days=7)
+
+
+def _period_key(kind):
+    today = date.today()
+    return partitions.month_start(today) if kind == 'month' else today
+
+
+# ==================== SERIALIZATION ====================
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def _decode(kind, payload):
+    data = json.loads(payload)
+    for row in data['categories']:
+        row['total'] = Decimal(row['total'])
+    if kind == 'month':
+        stats = data['stats']
+        for key in ('total', 'avg', 'max'):
+            stats[key] = Decimal(stats[key])
+    else:
+        for row in data['daily']:
+            row['date'] = date.fromisoformat(row['date'])
+            row['total'] = Decimal(row['total'])
+        data.setdefault('unconverted', [])
+    return data
+
+
+# ==================== SCHEDULER ====================
+
+class InlineRunner:
+    """Run refresh jobs on the scheduler thread itself.
+
+    Any object with an Executor-style ``submit(fn, *args)`` can replace
+    it, e.g. a ThreadPoolExecutor or an adapter for an external queue.
+    """
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class SnapshotScheduler:
+    """Debounced background refresh of per-user snapshots"""
+
+    def __init__(self, connect, runner=None, debounce=SNAPSHOT_DEBOUNCE_SECONDS):
+        self._connect = connect
+        self.runner = runner or InlineRunner()
+        self._debounce = debounce
+        self._cond = threading.Condition()
+        self._pending = {}      # user_id -> (due, first marked dirty)
+        self._refreshing = set()
+        self._thread = None
+        self._today = date.today()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_seconds = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    # ---- producers ----
+
+    def schedule(self, user_id, delay=None):
+        """Mark a user's snapshots dirty and refresh after the debounce delay"""
+        user_id = str(user_id)
+        now = time.monotonic()
+        due = now + (self._debounce if delay is None else delay)
+        with self._cond:
+            _, dirty_since = self._pending.get(user_id, (None, now))
+            self._pending[user_id] = (due, dirty_since)
+            self._cond.notify()
+        self._start()
+
+    def is_dirty(self, user_id):
+        user_id = str(user_id)
+        with self._cond:
+            return user_id in self._pending or user_id in self._refreshing
+
+    # ---- serving ----
+
+    def lookup(self, cursor, user_id, kind):
+        """Snapshot payload for one user, or None if missing, stale or from an old period"""
+        cursor.execute("""
+            SELECT s.period_key, s.payload, s.data_version,
+                   v.version as user_version, r.version as rates_version
+            FROM report_snapshots s
+            LEFT JOIN data_versions v ON v.scope = %s
+            LEFT JOIN data_versions r ON r.scope = %s
+            WHERE s.user_id = %s AND s.kind = %s
+        """, (http_cache.user_scope(user_id), http_cache.RATES_SCOPE, user_id, kind))
+        row = cursor.fetchone()
+        if row is None or row['period_key'] != _period_key(kind):
+            self.misses += 1
+            if not self.is_dirty(user_id):
+                self.schedule(user_id, delay=0)
+            return None
+        if row['data_version'] != http_cache.version_key(row['user_version'],
+                                                         row['rates_version']):
+            # Written (or rates imported) since the refresh, possibly by another worker
+            self.misses += 1
+            if not self.is_dirty(user_id):
+                self.schedule(user_id)
+            return None
+
+        self.hits += 1
+        return _decode(kind, row['payload'])
+
+    def refresh(self, user_id):
+        """Recompute and store both snapshots for one user now"""
+        user_id = str(user_id)
+        with self._cond:
+            entry = self._pending.pop(user_id, None)
+            self._refreshing.add(user_id)
+        self._refresh(user_id, entry[1] if entry else None)
+
+    def _refresh(self, user_id, dirty_since):
+        start = time.monotonic()
+        conn = None
+        try:
+            conn = self._connect()
+            if conn is None:
+                raise RuntimeError('no database connection for snapshot refresh')
+            cursor = conn.cursor(dictionary=True)
+            # Read first so the stored version never claims more than the aggregates saw
+            version, _ = http_cache.current_version(cursor, user_id)
+            month_start = partitions.month_start(date.today())
+            stats, categories = month_summary(cursor, user_id, month_start,
+                                              partitions.add_months(month_start, 1))
+            week_categories, daily, unconverted = period_totals(cursor, user_id, week_start())
+
+            for kind, payload in (('month', {'stats': stats, 'categories': categories}),
+                                  ('week', {'categories': week_categories, 'daily': daily,
+                                            'unconverted': unconverted})):
+                cursor.execute("""
+                    INSERT INTO report_snapshots
+                        (user_id, kind, period_key, payload, data_version, refreshed_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                    ON DUPLICATE KEY UPDATE period_key = VALUES(period_key),
+                        payload = VALUES(payload), data_version = VALUES(data_version),
+                        refreshed_at = VALUES(refreshed_at)
+                """, (user_id, kind, _period_key(kind),
+                      json.dumps(payload, default=_json_default), version))
+            conn.commit()
+            cursor.close()
+        except Exception:
+            # Keep serving live figures and retry after the debounce delay
+            self.schedule(user_id)
+            raise
+        finally:
+            if conn is not None:
+                conn.close()
+            with self._cond:
+                self._refreshing.discard(user_id)
+
+        now = time.monotonic()
+        self.refreshes += 1
+        self.refresh_seconds += now - start
+        if dirty_since is not None:
+            self.last_lag = now - dirty_since
+            self.max_lag = max(self.max_lag, self.last_lag)
+
+    # ---- worker ----
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='snapshot-scheduler',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._tick()
+            except Exception:
+                # The thread must outlive any single bad iteration
+                log.exception('snapshot scheduler iteration failed')
+                time.sleep(1)
+
+    def _tick(self):
+        with self._cond:
+            now = time.monotonic()
+            due = [(user_id, dirty_since) for user_id, (at, dirty_since)
+                   in self._pending.items() if at <= now]
+            for user_id, _ in due:
+                del self._pending[user_id]
+                self._refreshing.add(user_id)
+            if not due:
+                next_due = min((at for at, _ in self._pending.values()),
+                               default=now + ROLLOVER_CHECK_SECONDS)
+                self._cond.wait(min(next_due - now, ROLLOVER_CHECK_SECONDS))
+
+        today = date.today()
+        if today != self._today:
+            try:
+                self._schedule_rollover()
+                # Advance only once every user is queued; a failure retries next tick
+                self._today = today
+            except Exception:
+                log.exception('snapshot rollover failed; retrying')
+
+        for user_id, dirty_since in due:
+            try:
+                self.runner.submit(self._refresh, user_id, dirty_since)
+            except Exception:
+                log.exception('snapshot refresh failed for user %s', user_id)
+                with self._cond:
+                    self._refreshing.discard(user_id)
+                self.schedule(user_id)
+
+    def _schedule_rollover(self):
+        """Period-relative snapshots go stale at midnight; refresh every user"""
+        conn = self._connect()
+        if conn is None:
+            raise RuntimeError('no database connection for snapshot rollover')
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT user_id FROM report_snapshots")
+            user_ids = [user_id for (user_id,) in cursor.fetchall()]
+            cursor.close()
+        finally:
+            conn.close()
+        for user_id in user_ids:
+            self.schedule(user_id, delay=0)
+
+    # ---- metrics ----
+
+    def metrics_lines(self):
+        with self._cond:
+            pending = len(self._pending)
+        values = (
+            ('snapshot_hits_total', 'counter', self.hits),
+            ('snapshot_misses_total', 'counter', self.misses),
+            ('snapshot_refreshes_total', 'counter', self.refreshes),
+            ('snapshot_refresh_seconds_total', 'counter', self.refresh_seconds),
+            ('snapshot_pending', 'gauge', pending),
+            ('snapshot_staleness_seconds_last', 'gauge', self.last_lag),
+            ('snapshot_staleness_seconds_max', 'gauge', self.max_lag),
+        )
+        lines = []
+        for name, kind, value in values:
+            lines.append(f'# TYPE expense_tracker_{name} {kind}')
+            lines.append(f'expense_tracker_{name} {value}')
+        return lines
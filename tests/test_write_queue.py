@@ -0,0 +1,191 @@
+"""
+Tests - Group Commit Queue
+Runs GroupCommitQueue against SQLite files, with connection wrappers
+that inject failures, so no MySQL server is needed
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import sqlite3
+import unittest
+import shutil
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import write_queue
+
+INSERT = "INSERT INTO expenses (user_id, amount) VALUES (?, ?)"
+
+
+class FlakyConnection:
+    """SQLite connection whose execute/commit can be made to fail or block"""
+
+    def __init__(self, path, plan):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._plan = plan
+
+    def cursor(self):
+        return FlakyCursor(self._conn.cursor(), self._plan)
+
+    def commit(self):
+        self._plan.in_commit.set()
+        self._plan.commit_gate.wait()
+        if self._plan.commit_errors:
+            self._plan.commit_errors -= 1
+            raise write_queue.CONNECTION_ERRORS[0]('lost connection during commit')
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class FlakyCursor:
+
+    def __init__(self, cursor, plan):
+        self._cursor = cursor
+        self._plan = plan
+
+    def execute(self, sql, params):
+        if self._plan.execute_errors:
+            self._plan.execute_errors -= 1
+            raise write_queue.CONNECTION_ERRORS[0]('server has gone away')
+        return self._cursor.execute(sql, params)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class Plan:
+
+    def __init__(self):
+        self.execute_errors = 0
+        self.commit_errors = 0
+        self.commit_gate = threading.Event()
+        self.commit_gate.set()
+        self.in_commit = threading.Event()
+        self.connections = 0
+
+
+class GroupCommitQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'expenses.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute("""
+            CREATE TABLE expenses (
+                expense_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount NUMERIC NOT NULL CHECK (amount > 0)
+            )
+        """)
+        conn.commit()
+        conn.close()
+        self.plan = Plan()
+
+    def tearDown(self):
+        self.plan.commit_gate.set()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def connect(self):
+        self.plan.connections += 1
+        return FlakyConnection(self.path, self.plan)
+
+    def make_queue(self, **kwargs):
+        kwargs.setdefault('window_ms', 20)
+        return write_queue.GroupCommitQueue(self.connect, INSERT, **kwargs)
+
+    def stored(self):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute("SELECT expense_id, user_id, amount FROM expenses "
+                            "ORDER BY expense_id").fetchall()
+        conn.close()
+        return rows
+
+    def test_concurrent_inserts_share_commits(self):
+        writer = self.make_queue()
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            ids = list(pool.map(lambda i: writer.insert((i, 10)), range(500)))
+
+        self.assertEqual(len(set(ids)), 500)
+        self.assertEqual(sorted(ids), [row[0] for row in self.stored()])
+        self.assertEqual(writer.rows, 500)
+        self.assertLess(writer.commits, 500)
+
+    def test_failing_row_is_isolated(self):
+        writer = self.make_queue(window_ms=200)
+        futures = [writer.submit((1, 10)), writer.submit((2, -5)), writer.submit((3, 30))]
+
+        self.assertIsInstance(futures[1].exception(timeout=5), sqlite3.IntegrityError)
+        ids = [futures[0].result(timeout=5), futures[2].result(timeout=5)]
+        self.assertEqual([(row[1], row[2]) for row in self.stored()], [(1, 10), (3, 30)])
+        self.assertEqual(ids, [row[0] for row in self.stored()])
+
+    def test_before_commit_runs_in_the_batch_transaction(self):
+        seen = []
+        writer = self.make_queue(before_commit=lambda cursor, rows: seen.extend(rows))
+        writer.insert((7, 10))
+        self.assertEqual(seen, [(7, 10)])
+
+    @unittest.skipUnless(write_queue.CONNECTION_ERRORS, 'mysql.connector not installed')
+    def test_batch_replayed_once_after_connection_error(self):
+        writer = self.make_queue()
+        self.plan.execute_errors = 1
+        writer.insert((1, 10))
+
+        self.assertEqual(len(self.stored()), 1)
+        self.assertEqual(self.plan.connections, 2)
+
+    @unittest.skipUnless(write_queue.CONNECTION_ERRORS, 'mysql.connector not installed')
+    def test_batch_fails_after_second_connection_error(self):
+        writer = self.make_queue()
+        self.plan.execute_errors = 2
+        with self.assertRaises(write_queue.CONNECTION_ERRORS):
+            writer.insert((1, 10))
+        self.assertEqual(self.stored(), [])
+
+    @unittest.skipUnless(write_queue.CONNECTION_ERRORS, 'mysql.connector not installed')
+    def test_commit_failure_is_not_replayed(self):
+        writer = self.make_queue()
+        self.plan.commit_errors = 1
+        with self.assertRaises(write_queue.CONNECTION_ERRORS):
+            writer.insert((1, 10))
+        # A replay after an uncertain commit could write the row twice
+        self.assertEqual(self.plan.connections, 1)
+
+    def test_timed_out_row_is_never_written(self):
+        writer = self.make_queue(window_ms=1)
+        self.plan.commit_gate.clear()
+        held = writer.submit((1, 10))
+        # Rows arriving within the batch window would join the held batch
+        self.assertTrue(self.plan.in_commit.wait(5))
+
+        with self.assertRaises(TimeoutError):
+            writer.insert((2, 20), timeout=0.05)
+        self.plan.commit_gate.set()
+
+        held.result(timeout=5)
+        writer.insert((3, 30))
+        self.assertEqual([row[1] for row in self.stored()], [1, 3])
+
+    def test_timeout_waits_for_a_row_already_in_a_batch(self):
+        writer = self.make_queue(window_ms=1)
+        self.plan.commit_gate.clear()
+        threading.Timer(0.2, self.plan.commit_gate.set).start()
+
+        row_id = writer.insert((1, 10), timeout=0.05)
+        self.assertEqual([row[0] for row in self.stored()], [row_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
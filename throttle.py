@@ -0,0 +1,50 @@
+"""
+Expense Tracker - Request Throttling
+In-memory token buckets for rejecting login and registration floods
+before any database or password hashing work
+"""
+
+from collections import OrderedDict
+import threading
+import time
+import os
+
+LOGIN_IP_PER_MINUTE = float(os.environ.get('LOGIN_IP_PER_MINUTE', 20))
+LOGIN_IP_ACCOUNT_PER_MINUTE = float(os.environ.get('LOGIN_IP_ACCOUNT_PER_MINUTE', 5))
+LOGIN_ACCOUNT_PER_MINUTE = float(os.environ.get('LOGIN_ACCOUNT_PER_MINUTE', 30))
+MAX_TRACKED_KEYS = 100000
+
+
+class TokenBucket:
+    """Per-key token buckets refilled at ``per_minute`` up to ``burst``.
+
+    Keys are kept in least-recently-used order, so capping the table at
+    MAX_TRACKED_KEYS evicts the idlest bucket in O(1).
+    """
+
+    def __init__(self, per_minute, burst=None, max_keys=MAX_TRACKED_KEYS):
+        self.rate = per_minute / 60
+        self.burst = burst if burst is not None else per_minute
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+login_by_ip = TokenBucket(LOGIN_IP_PER_MINUTE)
+# Keyed on (ip, account) so guessing from one address cannot lock the
+# account out for everyone else
+login_by_ip_account = TokenBucket(LOGIN_IP_ACCOUNT_PER_MINUTE)
+# Keyed on the account alone with a higher limit, so guessing spread
+# across many addresses is still capped per account
+login_by_account = TokenBucket(LOGIN_ACCOUNT_PER_MINUTE)
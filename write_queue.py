@@ -0,0 +1,168 @@
+"""
+Expense Tracker - Group Commit Queue
+Gathers inserts from concurrent requests into short group-commit
+windows so a burst pays for one commit (and one fsync) per batch
+instead of one per row
+"""
+
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+import threading
+import queue
+import time
+import os
+
+try:
+    from mysql.connector import errors as mysql_errors
+    # The connection is gone (server restart, wait_timeout, network); the
+    # transaction was rolled back and the batch can be replayed
+    CONNECTION_ERRORS = (mysql_errors.OperationalError, mysql_errors.InterfaceError)
+except ImportError:
+    CONNECTION_ERRORS = ()
+
+GROUP_COMMIT_ENABLED = os.environ.get('GROUP_COMMIT_ENABLED', '0') == '1'
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 5))
+GROUP_COMMIT_MAX_ROWS = int(os.environ.get('GROUP_COMMIT_MAX_ROWS', 64))
+GROUP_COMMIT_TIMEOUT = 10
+
+INSERT_EXPENSE = """
+    INSERT INTO expenses (user_id, category_id, amount, description,
+                         expense_date, payment_method, notes)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+INSERT_EXPENSE_WITH_CURRENCY = """
+    INSERT INTO expenses (user_id, category_id, amount, description,
+                         expense_date, payment_method, notes, currency)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+class GroupCommitQueue:
+    """Single writer thread that commits queued inserts in batches.
+
+    Each caller gets a Future resolved with its row's ``lastrowid`` once
+    the batch holding it has committed. ``before_commit(cursor, rows)``
+    runs in the batch's transaction, e.g. to bump data versions.
+    """
+
+    def __init__(self, connect, sql, window_ms=GROUP_COMMIT_WINDOW_MS,
+                 max_rows=GROUP_COMMIT_MAX_ROWS, before_commit=None):
+        self._connect = connect
+        self._sql = sql
+        self._before_commit = before_commit
+        self._window = window_ms / 1000
+        self._max_rows = max_rows
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        self.commits = 0
+        self.rows = 0
+
+    def submit(self, params):
+        future = Future()
+        self._start()
+        self._queue.put((params, future))
+        return future
+
+    def insert(self, params, timeout=GROUP_COMMIT_TIMEOUT):
+        """Queue one row and block until it is durable; returns its id.
+
+        ``timeout`` only bounds the wait in the queue: a row the writer
+        has already taken is waited on to the end, so a timeout never
+        leaves a row that might still be inserted behind a retry.
+        """
+        future = self.submit(params)
+        try:
+            return future.result(timeout)
+        except FuturesTimeout:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = []
+            self._take(batch, self._queue.get())
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self._take(batch, self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    @staticmethod
+    def _take(batch, item):
+        # Rows whose caller gave up (cancelled) are never written
+        if item[1].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        elif hasattr(self._conn, 'ping'):
+            # The writer may sit idle past the server's wait_timeout
+            self._conn.ping(reconnect=True)
+        return self._conn
+
+    def _discard_connection(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _flush(self, batch, retried=False):
+        if not batch:
+            return
+
+        ids = []
+        committing = False
+        try:
+            conn = self._connection()
+            cursor = conn.cursor()
+            for index, (params, future) in enumerate(batch):
+                try:
+                    cursor.execute(self._sql, params)
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    # Fail only the offending row and replay the rest
+                    cursor.close()
+                    conn.rollback()
+                    future.set_exception(e)
+                    return self._flush(batch[:index] + batch[index + 1:], retried)
+                ids.append(cursor.lastrowid)
+            if self._before_commit is not None:
+                self._before_commit(cursor, [params for params, _ in batch])
+            cursor.close()
+            committing = True
+            conn.commit()
+        except Exception as e:
+            if self._conn is not None:
+                self._discard_connection()
+            # A failed commit may still have applied, so only replay earlier failures
+            if isinstance(e, CONNECTION_ERRORS) and not committing and not retried:
+                return self._flush(batch, retried=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.rows += len(batch)
+        for (_, future), row_id in zip(batch, ids):
+            future.set_result(row_id)